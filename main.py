@@ -1,18 +1,47 @@
 # --- Imports ---
 import configparser                    # For reading the configuration file (API keys)
-from datetime import datetime, timedelta, timezone # For handling dates and times
-from zoneinfo import ZoneInfo          # For more robust timezone handling (like 'Asia/Singapore')
+import functools                       # For memoizing small pure helper functions
+import itertools                       # For flattening the paginated results
+import types                           # For read-only mapping views (MappingProxyType)
+from datetime import datetime, timedelta # For handling dates and times
 
 # Third-party libraries
 import requests                        # For making HTTP requests to Oanda
+import orjson                          # Fast JSON parsing of the API responses
+from requests.adapters import HTTPAdapter # For connection pooling on the shared HTTP session
+from urllib3.util.retry import Retry   # For retrying failed/rate-limited requests
 import pandas as pd                    # For data manipulation and analysis (DataFrames)
+import numpy as np                     # For fast array operations on DataFrame columns
 import plotly.express as px            # For creating interactive charts
+import plotly.graph_objects as go      # For per-render copies of the cached figures
 import plotly.io as pio                # Plotly Input/Output, for saving/displaying charts
 import streamlit as st                 # For creating the web application interface
 # import investpy                    # REMOVED: Broken library causing crashes
-import pytz                            # For the list of all timezones
 import os                              # Provides functions to interact with the OS (e.g., os.path.exists)
 import time                            # Provides time-related functions (e.g., time.sleep)
+from concurrent.futures import ThreadPoolExecutor # For running independent work on a thread pool
+
+# --- Shared HTTP Session ---
+# One session for every Oanda API call, so HTTPS connections are kept alive and reused
+# (no new TCP + TLS handshake per request). The pool is sized for the concurrent page
+# fetches in fetch_trade_history, and transient errors/rate limits are retried with backoff.
+_session = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=8,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+)
+_session.mount('https://', _adapter)
+REQUEST_TIMEOUT = (3.05, 30) # (connect, read) timeouts in seconds
+
+# --- Transaction Parsing Constants ---
+# 'pl' values Oanda sends for transactions that didn't realize any Profit/Loss
+ZERO_PL_STRINGS = frozenset(('0', '0.0', '0.00', '0.0000', '-0.0000', '0.00000'))
+
+# --- Plotly Serialization ---
+# st.plotly_chart serializes every figure with plotly.io.to_json on each rerun.
+# orjson encodes the trace arrays much faster than the default json engine.
+pio.json.config.default_engine = "orjson"
 
 # --- Function to create the config file ---
 # Note: This function appears to be unused in the main app, but is kept.
@@ -40,7 +69,10 @@ def get_config():
     Reads API credentials based on the active environment in session_state.
     - 'live' state reads 'config.ini'
     - 'demo' state reads 'config_demo.ini'
-    
+
+    The parsed file is cached (see _load_config) and only re-read when the file
+    is modified, so Streamlit reruns don't re-parse the INI file on every call.
+
     Raises FileNotFoundError if the file or the 'OANDA' section is missing.
     Raises ValueError if any required keys are missing.
     """
@@ -54,12 +86,27 @@ def get_config():
     else:
         config_file = 'config.ini'
 
-    config = configparser.ConfigParser()
-    
-    # Check 1: Does the selected file exist?
-    if not os.path.exists(config_file):
+    # Check 1: Does the selected file exist? (A single stat call, which also
+    # gives us the modification time used to invalidate the parse cache.)
+    try:
+        mtime_ns = os.stat(config_file).st_mtime_ns
+    except OSError:
         raise FileNotFoundError(f"Config file '{config_file}' not found for {active_env} environment.")
 
+    return _load_config(config_file, mtime_ns)
+
+@functools.lru_cache(maxsize=4)
+def _load_config(config_file, mtime_ns):
+    """
+    Parses and validates a config file. Cached per (file, modification time), so
+    saving new credentials (or editing the file by hand) is picked up automatically.
+    Exceptions are not cached by lru_cache, so an invalid file is re-checked each call.
+
+    Returns:
+        A read-only mapping with ACCOUNT_ID, ACCESS_TOKEN, ENVIRONMENT and the values
+        precomputed from them: BASE_URL, HEADERS, SUMMARY_URL and TRANSACTIONS_URL.
+    """
+    config = configparser.ConfigParser()
     config.read(config_file) # Load the config file
 
     # Check 2: Does the 'OANDA' section exist?
@@ -69,9 +116,26 @@ def get_config():
     # Check 3: Are keys present? (Good practice)
     if 'ACCOUNT_ID' not in config['OANDA'] or 'ACCESS_TOKEN' not in config['OANDA'] or 'ENVIRONMENT' not in config['OANDA']:
          raise ValueError(f"Config file '{config_file}' is missing a required key.")
-    
-    # Return the 'OANDA' section containing credentials
-    return config['OANDA']
+
+    section = config['OANDA']
+    account_id = section['ACCOUNT_ID']
+    access_token = section['ACCESS_TOKEN']
+    environment = section['ENVIRONMENT'] # 'live' or 'practice'
+    # Determine the correct API base URL (live or practice) once, here
+    base_url = "https://api-fxtrade.oanda.com" if environment == 'live' else "https://api-fxpractice.oanda.com"
+    # Return a frozen copy of the 'OANDA' section. A SectionProxy is a mutable view,
+    # which must not be shared between reruns through the cache.
+    return types.MappingProxyType({
+        'ACCOUNT_ID': account_id,
+        'ACCESS_TOKEN': access_token,
+        'ENVIRONMENT': environment,
+        'BASE_URL': base_url,
+        # Required headers for Oanda API authentication (read-only, shared by every request)
+        'HEADERS': types.MappingProxyType({"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}),
+        # API endpoint URLs for the account summary and for a range of transactions by ID
+        'SUMMARY_URL': f"{base_url}/v3/accounts/{account_id}/summary",
+        'TRANSACTIONS_URL': f"{base_url}/v3/accounts/{account_id}/transactions/idrange",
+    })
 
 def save_config(env_type, account_id, access_token):
     """
@@ -265,7 +329,9 @@ def show_setup_or_edit_page():
 
 # Use Streamlit's caching to avoid re-fetching data on every interaction.
 # The cache is invalidated if 'refresh_key' changes (triggered by the refresh button).
-@st.cache_data
+# Entries also expire after 60 seconds so the balance (and last transaction ID) stay
+# fresh, and only the latest entry is kept.
+@st.cache_data(ttl=60, max_entries=1)
 def get_account_summary(refresh_key):
     """
     Connects to the Oanda API and fetches the basic account summary.
@@ -277,137 +343,218 @@ def get_account_summary(refresh_key):
     try:
         # Load API credentials from the *active* config file
         config = get_config()
-        account_id = config['ACCOUNT_ID']
-        access_token = config['ACCESS_TOKEN']
-        environment = config['ENVIRONMENT'] # 'live' or 'practice'
-
-        # Determine the correct API base URL (live or practice)
-        base_url = "https://api-fxtrade.oanda.com" if environment == 'live' else "https://api-fxpractice.oanda.com"
-        # Set required headers for Oanda API authentication
-        headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
-
-        # Construct the API endpoint URL for account summary
-        summary_url = f"{base_url}/v3/accounts/{account_id}/summary"
-        # Make the GET request to the Oanda API
-        summary_response = requests.get(summary_url, headers=headers)
+
+        # Make the GET request to the Oanda API (URL and auth headers are precomputed by get_config)
+        summary_response = _session.get(config['SUMMARY_URL'], headers=config['HEADERS'], timeout=REQUEST_TIMEOUT)
         summary_response.raise_for_status() # Automatically check for HTTP errors (like 401, 404)
-        # Return the JSON response (account details)
-        return summary_response.json()
+        # Return the JSON response (account details), parsed straight from the raw bytes
+        return orjson.loads(summary_response.content)
 
     except Exception as e:
         # Display error in the Streamlit app if fetching fails
         st.error(f"Error fetching account summary: {e}")
         return None # Return None to indicate failure
 
-# Use caching, invalidated by refresh_key or changes in last_transaction_id.
-@st.cache_data
-def fetch_trade_history(refresh_key, last_transaction_id):
+# Use caching, keyed on the account and its last transaction ID. Oanda transactions never
+# change once written, so a history is only re-fetched when a new transaction exists
+# (the Refresh button just re-reads the summary to find out).
+# Bounded so old trade histories (one per distinct last_transaction_id) don't pile up
+# in memory for the life of the process: at most 3 entries, each kept for an hour.
+# cache_resource returns the shared DataFrame itself instead of a deep copy on every
+# rerun (as cache_data would), so callers must treat it as read-only.
+@st.cache_resource(ttl=3600, max_entries=3, show_spinner=False)
+def fetch_trade_history(account_id, last_transaction_id):
     """
     Fetches all transactions for the account from ID 1 up to the provided last_transaction_id.
+    Transactions already saved in the on-disk cache are loaded from there, and only
+    the newer IDs are requested from the API.
     Uses pagination (requests chunks of 1000) to ensure all data is retrieved.
     Processes transactions to extract details for closed trades (with realized P/L)
     and includes account balance after the trade if available.
-    Cache depends on 'refresh_key' and 'last_transaction_id'.
+    Cache depends on 'account_id' (the active account) and 'last_transaction_id'.
     """
-    print(f"RUNNING: fetch_trade_history() with key: {refresh_key}, up to ID: {last_transaction_id}")
+    print(f"RUNNING: fetch_trade_history() for account: {account_id}, up to ID: {last_transaction_id}")
 
-    # Load API credentials
+    # Load API credentials (for the same active account as 'account_id')
     config = get_config()
-    account_id = config['ACCOUNT_ID']
-    access_token = config['ACCESS_TOKEN']
-    environment = config['ENVIRONMENT']
 
-    # Set up API connection details
-    base_url = "https://api-fxtrade.oanda.com" if environment == 'live' else "https://api-fxpractice.oanda.com"
-    headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
+    true_last_id = int(last_transaction_id) # Ensure the target ID is an integer
+
+    # --- On-Disk Cache Check ---
+    # The fully processed DataFrame is saved as Parquet after each fetch, one file per
+    # account, together with the last transaction ID it covers. Oanda transaction IDs
+    # only ever increase, so a fresh process (or a cleared Streamlit cache) loads the
+    # saved history and only fetches the transactions after that ID.
+    cache_path = get_trade_cache_path(account_id)
+    cached_df, saved_last_id = load_trade_cache(cache_path)
+    if saved_last_id > true_last_id:
+        # The cache covers IDs this account doesn't have (e.g., a reset demo account)
+        cached_df, saved_last_id = None, 0
+    if saved_last_id == true_last_id:
+        print(f"Loading trade history from disk cache: {cache_path}")
+        return cached_df
+
+    # API connection details (precomputed once by get_config)
+    transactions_url = config['TRANSACTIONS_URL'] # Fetches a range of transactions by ID
+    headers = config['HEADERS']
 
     # --- Pagination Logic ---
-    # We must fetch transactions in chunks as the API limits responses (e.g., to 1000)
-    all_transactions = []           # List to store all fetched transactions
-    current_from_id = 1             # Starting transaction ID for the first chunk
+    # We must fetch transactions in chunks as the API limits responses (e.g., to 1000).
+    # The full ID range is known up front, so every (from, to) window is computed first
+    # and the windows are requested concurrently instead of one round-trip at a time.
     page_size = 1000                # Oanda API limit per request
-    true_last_id = int(last_transaction_id) # Ensure the target ID is an integer
-
-    print("\n--- Fetching transactions in chunks... ---")
-    # Loop until we've fetched transactions beyond the last known ID
-    while current_from_id <= true_last_id:
-        # Determine the end ID for the current chunk (don't exceed true_last_id)
-        current_to_id = min(current_from_id + page_size - 1, true_last_id)
-        print(f"Fetching chunk: IDs {current_from_id} to {current_to_id}...")
-
-        # Construct the API endpoint URL for fetching a range of transactions by ID
-        transactions_url = f"{base_url}/v3/accounts/{account_id}/transactions/idrange"
-        # Set the 'from' and 'to' parameters for the API request
-        params = {"from": str(current_from_id), "to": str(current_to_id)}
-
-        # Make the GET request
-        response = requests.get(transactions_url, headers=headers, params=params)
-        response.raise_for_status() # Check for HTTP errors
-        data = response.json()      # Parse the JSON response
-
-        # Extract the list of transactions from the response
-        chunk_transactions = data.get('transactions', [])
-        if not chunk_transactions:
-            # Stop if the API returns an empty list (shouldn't happen before reaching last_id)
-            break
-        # Add the fetched transactions to our main list
-        all_transactions.extend(chunk_transactions)
-        # Set the starting ID for the next chunk
-        current_from_id = current_to_id + 1
-    print(f"SUCCESS! Fetched a total of {len(all_transactions)} transactions.")
+    max_workers = 8                 # Concurrent requests, kept low to respect Oanda's rate limits
+    current_from_id = saved_last_id + 1 # Start after the last cached transaction (1 if none)
+    id_ranges = [(from_id, min(from_id + page_size - 1, true_last_id))
+                 for from_id in range(current_from_id, true_last_id + 1, page_size)]
+
+    print(f"\n--- Fetching transactions in {len(id_ranges)} chunks... ---")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # executor.map returns the chunks in the same order as id_ranges (chronological)
+        chunks = executor.map(
+            lambda id_range: fetch_transaction_chunk(transactions_url, headers, *id_range),
+            id_ranges
+        )
+        # Flatten the per-page lists into one list of closed-trade transactions
+        all_transactions = list(itertools.chain.from_iterable(chunks))
+    print(f"SUCCESS! Fetched a total of {len(all_transactions)} closed trades.")
     # --- End Pagination Logic ---
 
-    # --- Process Fetched Transactions ---
-    trade_data = [] # List to store processed data for closed trades
-    # Loop through every transaction fetched
-    for t in all_transactions:
-        # Check if the transaction has a 'pl' field (Profit/Loss) and it's not zero.
-        # This is our primary filter for identifying a "closed trade" transaction.
-        if 'pl' in t and float(t['pl']) != 0:
-            # Determine if the original trade was Buy or Sell based on the closing units
-            # Oanda uses negative units for closing a Buy trade, positive for closing a Sell.
-            trade_type = 'Buy' if float(t.get('units', 0)) < 0 else 'Sell'
-
-            # Try to get the account balance recorded *after* this transaction occurred.
-            balance_after_trade = t.get('accountBalance', None)
-            if balance_after_trade:
-                balance_after_trade = float(balance_after_trade)
-            else:
-                # Use pandas Not Available (NA) if balance is missing
-                balance_after_trade = pd.NA
-
-            # Append the relevant details to our trade_data list
-            trade_data.append({
-                "Date": t['time'],                  # Timestamp of the transaction (closing time)
-                "Instrument": t['instrument'],      # Trading instrument (e.g., EUR_USD)
-                "Buy/Sell": trade_type,             # Original trade direction (Buy or Sell)
-                "Amount": abs(float(t.get('units', 0))),# Size of the closed trade (absolute value)
-                "Profit/Loss": float(t['pl']),      # Realized profit or loss for this trade
-                "Account Balance": balance_after_trade  # Account balance after this transaction
-            })
-
-    if not trade_data:
-        # Handle case where no closed trades were found
-        print("\nNo completed trades with P/L found in this transaction range.")
-        return None # Return None to indicate no data
-
-    # --- Convert List to DataFrame and Clean Data ---
-    
-    # Convert the list of trade data into a pandas DataFrame
-    df = pd.DataFrame(trade_data)
-    # Convert the 'Date' column from string to timezone-aware datetime objects (UTC initially)
-    # Oanda always returns datetimes in UTC.
-    df['Date'] = pd.to_datetime(df['Date'])
-    # Ensure 'Profit/Loss' is a float
-    df['Profit/Loss'] = df['Profit/Loss'].astype(float)
-    # Convert 'Account Balance' to numeric, setting errors='coerce' turns non-numeric values into NA
-    df['Account Balance'] = pd.to_numeric(df['Account Balance'], errors='coerce')
-
-    # Sort the DataFrame by Date in descending order (most recent first) for display later
-    df = df.sort_values(by='Date', ascending=False)
+    if not all_transactions:
+        if cached_df is None:
+            # Handle case where no closed trades were found
+            print("\nNo completed trades with P/L found in this transaction range.")
+            return None # Return None to indicate no data
+        # No new closed trades: the cached history is still complete up to true_last_id
+        cached_df.attrs['last_id'] = true_last_id
+        save_trade_cache(cached_df, cache_path)
+        return cached_df
+
+    # --- Process Fetched Transactions (Vectorized) ---
+    # 'all_transactions' only holds closed trades (already filtered per page).
+    # Load them into a raw DataFrame once, then derive every output column with
+    # vectorized operations instead of a per-transaction Python loop.
+    raw = pd.DataFrame.from_records(all_transactions, columns=['time', 'instrument', 'units', 'pl', 'accountBalance'])
+    units = pd.to_numeric(raw['units'], errors='coerce').fillna(0)
+
+    df = pd.DataFrame({
+        # Timestamp of the transaction (closing time). Oanda always returns RFC 3339
+        # datetimes in UTC, so the format is given instead of being inferred per call.
+        'Date': pd.to_datetime(raw['time'], utc=True, format='ISO8601'),
+        # Trading instrument (e.g., EUR_USD). Only a handful of distinct values, so
+        # 'category' stores it as small integer codes.
+        'Instrument': raw['instrument'].astype('category'),
+        # Original trade direction. Oanda uses negative units for closing a Buy trade,
+        # positive for closing a Sell.
+        'Buy/Sell': pd.Categorical(np.where(units < 0, 'Buy', 'Sell')),
+        # Size of the closed trade (absolute value)
+        'Amount': units.abs().astype('float32'),
+        # Realized profit or loss for this trade. Stored as float32 to halve the memory
+        # read by every filter/aggregation; sums are accumulated in float64.
+        'Profit/Loss': pd.to_numeric(raw['pl'], errors='coerce').astype('float32'),
+        # Account balance after this transaction; missing/non-numeric values become NA.
+        # Kept as float64: balances can exceed float32's ~7 significant digits.
+        'Account Balance': pd.to_numeric(raw['accountBalance'], errors='coerce')
+    })
+
+    # Sort the DataFrame by Date once, in ascending (chronological) order.
+    # Every filtered slice is then already sorted for the cumulative charts;
+    # the history table reverses it to show the most recent trades first.
+    # The rows arrive in transaction ID order, and a stable sort keeps that order for
+    # trades closed at the same timestamp (so the running balance/P/L stay consistent).
+    df = df.sort_values(by='Date', ascending=True, kind='stable')
+
+    if cached_df is not None:
+        # Append the new trades to the cached history (new IDs are always later trades,
+        # so appending keeps the same Date-then-ID order a full fetch would produce).
+        # The categorical columns are rebuilt, since the two parts have different categories.
+        df = pd.concat([cached_df, df], ignore_index=True)
+        df = df.astype({'Instrument': 'category', 'Buy/Sell': 'category'})
+
+    # Save to the on-disk cache for the next process start
+    df.attrs['last_id'] = true_last_id # Stored in the Parquet metadata
+    save_trade_cache(df, cache_path)
     # Return the processed DataFrame
     return df
 
+def fetch_transaction_chunk(transactions_url, headers, from_id, to_id):
+    """
+    Fetches one page of transactions (IDs 'from_id' to 'to_id', inclusive) and
+    returns only its closed trades, projected down to the fields we use.
+    Filtering per page means the full raw page is dropped as soon as it's processed,
+    instead of every raw transaction being kept until the whole history is fetched.
+    Called concurrently from fetch_trade_history's thread pool.
+    """
+    print(f"Fetching chunk: IDs {from_id} to {to_id}...")
+    # Set the 'from' and 'to' parameters for the API request
+    params = {"from": str(from_id), "to": str(to_id)}
+    # Make the GET request
+    response = _session.get(transactions_url, headers=headers, params=params, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status() # Check for HTTP errors
+    # Extract the list of transactions from the JSON response
+    # (orjson parses the raw bytes directly, several times faster than response.json())
+    chunk_transactions = orjson.loads(response.content).get('transactions', [])
+
+    # Keep only transactions with a non-zero 'pl' field (Profit/Loss).
+    # This is our primary filter for identifying a "closed trade" transaction.
+    # Oanda's usual zero strings are rejected by a set lookup before any float() call.
+    return [
+        {
+            'time': t['time'],
+            'instrument': t['instrument'],
+            'units': t.get('units', 0),
+            'pl': pl,
+            'accountBalance': t.get('accountBalance')
+        }
+        for t in chunk_transactions
+        if (pl := t.get('pl')) is not None and pl not in ZERO_PL_STRINGS and float(pl) != 0
+    ]
+
+# Format version of the cached trade history. Bump it whenever the columns, dtypes or
+# row order produced by fetch_trade_history change: caches written with another version
+# are discarded and the history is re-fetched in full instead of being appended to.
+TRADE_CACHE_VERSION = 2
+
+def get_trade_cache_path(account_id):
+    """
+    Returns the Parquet file path used to cache the processed trade history of 'account_id'.
+    """
+    return os.path.join('cache', f"trades_{account_id}.parquet")
+
+def load_trade_cache(cache_path):
+    """
+    Reads the cached trade history from 'cache_path'.
+
+    Returns:
+        tuple: (df, last_id), where last_id is the last transaction ID the cached
+               history covers. (None, 0) if there is no usable cache file, or if it
+               was written by a different TRADE_CACHE_VERSION.
+    """
+    if not os.path.exists(cache_path):
+        return None, 0
+    try:
+        df = pd.read_parquet(cache_path, engine='pyarrow')
+        if df.attrs.get('cache_version') != TRADE_CACHE_VERSION:
+            print(f"Ignoring trade history cache '{cache_path}': format version {df.attrs.get('cache_version')}, expected {TRADE_CACHE_VERSION}")
+            return None, 0
+        return df, int(df.attrs.get('last_id', 0))
+    except Exception as e:
+        print(f"WARNING: Could not read trade history cache '{cache_path}': {e}")
+        return None, 0
+
+def save_trade_cache(df, cache_path):
+    """
+    Writes the processed trade DataFrame (including its 'last_id' attribute) to
+    'cache_path', tagged with the current TRADE_CACHE_VERSION. Failures are only
+    logged, since the cache is optional.
+    """
+    df.attrs['cache_version'] = TRADE_CACHE_VERSION # Stored in the Parquet metadata
+    try:
+        os.makedirs('cache', exist_ok=True)
+        df.to_parquet(cache_path, engine='pyarrow', compression='zstd')
+    except Exception as e:
+        print(f"WARNING: Could not write trade history cache '{cache_path}': {e}")
+
 # Use caching with a Time-To-Live (TTL) of 900 seconds (15 minutes).
 @st.cache_data(ttl=900)
 def fetch_ff_events():
@@ -422,6 +569,8 @@ def fetch_ff_events():
 def calculate_statistics(df, df_sorted_for_charts):
     """
     Calculates various performance statistics based on the filtered trade data.
+    The 'Profit/Loss' and 'Cumulative P/L' columns are pulled out as NumPy arrays
+    once, and the win/loss masks are built once and reused by every reduction.
     
     Args:
         df (pd.DataFrame): The filtered trade DataFrame (used for simple stats).
@@ -431,31 +580,40 @@ def calculate_statistics(df, df_sorted_for_charts):
     """
     stats = {} # Dictionary to hold the calculated statistics
 
+    # Extract the P/L values as a plain float array
+    pl_array = df['Profit/Loss'].to_numpy(dtype=np.float64)
+
     # --- Basic Performance Metrics ---
-    stats['total_pl'] = df['Profit/Loss'].sum() # Net Profit/Loss
+    stats['total_pl'] = pl_array.sum() # Net Profit/Loss
 
-    # Separate winning and losing trades
-    wins_df = df[df['Profit/Loss'] > 0]
-    losses_df = df[df['Profit/Loss'] < 0]
+    # Separate winning and losing trades (boolean masks built once)
+    wins = pl_array[pl_array > 0]
+    losses = pl_array[pl_array < 0]
 
     # Counts
-    stats['win_count'] = len(wins_df)
-    stats['loss_count'] = len(losses_df)
+    stats['win_count'] = wins.size
+    stats['loss_count'] = losses.size
     stats['total_trades'] = stats['win_count'] + stats['loss_count']
 
     # Win Rate (%)
     stats['win_rate'] = (stats['win_count'] / stats['total_trades'] * 100) if stats['total_trades'] > 0 else 0
 
     # Average Win/Loss values
-    stats['avg_win'] = wins_df['Profit/Loss'].mean() if stats['win_count'] > 0 else 0
-    stats['avg_loss'] = losses_df['Profit/Loss'].mean() if stats['loss_count'] > 0 else 0
+    stats['avg_win'] = wins.mean() if stats['win_count'] > 0 else 0
+    stats['avg_loss'] = losses.mean() if stats['loss_count'] > 0 else 0
 
     # Most Traded Instrument
-    stats['most_traded'] = df['Instrument'].mode()[0] if not df.empty else "N/A"
+    # Count the categorical codes directly (ties go to the first category, as with mode())
+    instrument_codes = df['Instrument'].cat.codes.to_numpy()
+    instrument_codes = instrument_codes[instrument_codes >= 0] # Drop missing instruments (code -1)
+    if instrument_codes.size > 0:
+        stats['most_traded'] = df['Instrument'].cat.categories[np.bincount(instrument_codes).argmax()]
+    else:
+        stats['most_traded'] = "N/A"
 
     # --- Ratios ---
-    gross_profit = wins_df['Profit/Loss'].sum()       # Sum of all positive P/L
-    gross_loss = abs(losses_df['Profit/Loss'].sum())  # Sum of absolute values of negative P/L
+    gross_profit = wins.sum()       # Sum of all positive P/L
+    gross_loss = abs(losses.sum())  # Sum of absolute values of negative P/L
 
     # Profit Factor (Gross Profit / Gross Loss)
     # Handle cases with zero loss (infinite PF) or zero profit/loss
@@ -466,27 +624,31 @@ def calculate_statistics(df, df_sorted_for_charts):
     stats['win_loss_ratio'] = (stats['win_count'] / stats['loss_count']) if stats['loss_count'] > 0 else (float('inf') if stats['win_count'] > 0 else 0)
 
     # --- Extremes ---
-    stats['largest_win'] = wins_df['Profit/Loss'].max() if stats['win_count'] > 0 else 0    # Biggest single win
-    stats['largest_loss'] = losses_df['Profit/Loss'].min() if stats['loss_count'] > 0 else 0   # Biggest single loss (most negative)
+    stats['largest_win'] = wins.max() if stats['win_count'] > 0 else 0    # Biggest single win
+    stats['largest_loss'] = losses.min() if stats['loss_count'] > 0 else 0   # Biggest single loss (most negative)
 
     # --- Max Drawdown Calculation ---
     # This is the most complex stat. It finds the biggest drop from a peak.
     # We use the pre-calculated 'Cumulative P/L' column from the sorted DataFrame
     if 'Cumulative P/L' in df_sorted_for_charts.columns:
         cumulative_pl = df_sorted_for_charts['Cumulative P/L']
-        # Include a starting point of 0 before the first trade
-        cumulative_pl_with_start = pd.concat([pd.Series([0]), cumulative_pl], ignore_index=True)
+        # Include a starting point of 0 before the first trade (one preallocated buffer)
+        cumulative_pl_with_start = np.empty(len(cumulative_pl) + 1, dtype=np.float64)
+        cumulative_pl_with_start[0] = 0
+        cumulative_pl_with_start[1:] = cumulative_pl.to_numpy()
 
         # Find the running maximum (peak) P/L up to each point
-        running_max = cumulative_pl_with_start.cummax()
-        # Calculate the drawdown (difference between running peak and current P/L)
-        drawdown = running_max - cumulative_pl_with_start
-        # Find the maximum value in the drawdown series
-        max_drawdown_value = drawdown.max()
+        running_max = np.maximum.accumulate(cumulative_pl_with_start)
+        # Calculate the drawdown in place (running peak minus current P/L);
+        # the cumulative buffer isn't needed after this
+        drawdown = np.subtract(running_max, cumulative_pl_with_start, out=cumulative_pl_with_start)
+        # Find the position and value of the largest drawdown
+        max_drawdown_pos = int(drawdown.argmax())
+        max_drawdown_value = float(drawdown[max_drawdown_pos])
 
         # Calculate Max Drawdown Percentage relative to the peak it dropped from
-        if not drawdown.empty and drawdown.max() > 0: # Check if drawdown exists
-             peak_at_max_drawdown = running_max[drawdown.idxmax()] # Find peak before max drop
+        if max_drawdown_value > 0: # Check if drawdown exists
+             peak_at_max_drawdown = float(running_max[max_drawdown_pos]) # Find peak before max drop
              if peak_at_max_drawdown > 0: # Avoid division by zero
                  max_drawdown_percent = (max_drawdown_value / peak_at_max_drawdown) * 100
              else:
@@ -505,7 +667,382 @@ def calculate_statistics(df, df_sorted_for_charts):
     # Return the dictionary containing all calculated statistics
     return stats
 
+def aggregate_by_instrument(df):
+    """
+    Calculates the total P/L and the number of trades for each instrument.
+    'Instrument' is categorical, so both results come from np.bincount over its
+    integer codes (one C loop each, no hashing of the instrument names).
+
+    Returns:
+        pd.DataFrame: Columns 'Instrument', 'Profit/Loss' and 'Count'.
+    """
+    instrument_col = df['Instrument']
+    categories = instrument_col.cat.categories
+    codes = instrument_col.cat.codes.to_numpy()
+    pl_values = df['Profit/Loss'].to_numpy(dtype=np.float64)
+
+    # Drop trades with a missing instrument (code -1), as groupby did
+    valid = codes >= 0
+    if not valid.all():
+        codes = codes[valid]
+        pl_values = pl_values[valid]
+
+    # Sum and count per category code (sums accumulated in float64)
+    pl_sums = np.bincount(codes, weights=pl_values, minlength=len(categories))
+    counts = np.bincount(codes, minlength=len(categories))
+
+    # Only keep instruments that actually appear in this slice. No sort: the charts
+    # order the bars by value themselves.
+    present = counts > 0
+    return pd.DataFrame({
+        'Instrument': pd.Categorical(categories[present], categories=categories),
+        'Profit/Loss': pl_sums[present],
+        'Count': counts[present]
+    })
+
+# --- Filtered Data Preparation ---
+
+# Keyed on 'data_key' (account ID, last transaction ID) plus the filter values;
+# the trade history itself is not hashed (leading underscore). Cached as a resource,
+# like the trade history and the figures: a hit returns the stored frames by reference
+# instead of unpickling copies of them, so callers must treat the result as read-only.
+@st.cache_resource(max_entries=8, show_spinner=False)
+def prepare_filtered(data_key, _trade_df, start_date, end_date, instruments):
+    """
+    Applies the date and instrument filters to the trade history and calculates
+    everything the dashboard shows for the filtered trades: the cumulative P/L,
+    the key statistics, and the per-instrument and per-period aggregates.
+
+    Args:
+        data_key (tuple): Hashable description of the account and the data version.
+        _trade_df (pd.DataFrame): The full trade history, sorted by Date (UTC).
+        start_date (date): First day to include.
+        end_date (date): Last day to include.
+        instruments (tuple): Instruments to include (empty tuple for all).
+
+    Returns:
+        dict: 'df_filtered' (Date in the display timezone, plus a 'Day' column),
+              'df_sorted' (UTC, with 'Cumulative P/L'), 'stats', 'pl_by_instrument',
+              'count_by_instrument', 'pl_by_year', 'pl_by_month', 'pl_by_day' and
+              'tz_error' (the timezone conversion error message, or None).
+              None if no trades match.
+    """
+    print(f"RUNNING: prepare_filtered() with key: {data_key}, {start_date} - {end_date}, {instruments}")
+
+    # Build UTC-aware Timestamps directly from the filter dates for comparison
+    # (since the DataFrame 'Date' column is in UTC)
+    start_datetime_utc = pd.Timestamp(start_date, tz='UTC')
+    # Add one day to the end date to make the range inclusive
+    end_datetime_utc = pd.Timestamp(end_date, tz='UTC') + pd.Timedelta(days=1)
+
+    # Apply date filter
+    # _trade_df is sorted by Date, so the range bounds are found with two binary
+    # searches and the rows taken as one contiguous slice (no full-column mask)
+    date_col = _trade_df['Date']
+    lo = date_col.searchsorted(start_datetime_utc, side='left')
+    hi = date_col.searchsorted(end_datetime_utc, side='left')
+    df_filtered_utc = _trade_df.iloc[lo:hi]
+
+    # Apply instrument filter if any are selected
+    # ('Instrument' is categorical: compare the small integer codes instead of strings)
+    if instruments:
+        instrument_col = df_filtered_utc['Instrument']
+        sel_codes = instrument_col.cat.categories.get_indexer(list(instruments))
+        # get_indexer returns -1 for a selection that isn't a category, which would
+        # otherwise match the rows with a missing instrument (code -1)
+        sel_codes = sel_codes[sel_codes >= 0]
+        mask = np.isin(instrument_col.cat.codes.to_numpy(), sel_codes)
+        df_filtered_utc = df_filtered_utc.iloc[mask]
+    # The slice is never modified; the derived frames below are built with .assign,
+    # which returns a new (copied) frame instead of writing into this one
+
+    if df_filtered_utc.empty:
+        return None
+
+    # --- Convert Timezone for Display (for trade history) ---
+    # We keep the UTC dataframe for calculations but convert this
+    # one for display in the table.
+    # The error is returned rather than shown here: a cached function's body doesn't
+    # run on a cache hit, so main() reports it on every run instead.
+    tz_error = None
+    try:
+        # Convert to 'Asia/Singapore' for display (.assign returns a new frame)
+        df_filtered = df_filtered_utc.assign(Date=df_filtered_utc['Date'].dt.tz_convert('Asia/Singapore'))
+    except Exception as e:
+        tz_error = str(e)
+        df_filtered = df_filtered_utc.copy() # Fallback to UTC
+
+    # The trade history is stored in chronological order, so the filtered slice is
+    # already sorted for the cumulative charts (no sort needed)
+    # Calculate Cumulative P/L on the sorted data
+    # (accumulated in float64, since 'Profit/Loss' is stored as float32)
+    df_sorted_for_charts = df_filtered_utc.assign(**{
+        'Cumulative P/L': df_filtered_utc['Profit/Loss'].to_numpy(dtype=np.float64).cumsum()
+    })
+
+    # Calculate all key performance indicators
+    stats = calculate_statistics(df_filtered, df_sorted_for_charts)
+
+    # Prepare data for Bar Charts (using the display-timezone DF)
+    # Group on compact integer keys instead of per-row strings; only the
+    # small aggregated results are converted back to labels.
+    date_parts = df_filtered['Date'].dt # One datetime accessor shared by all three keys
+    year_i = date_parts.year.to_numpy(dtype=np.int16)
+    month_i = date_parts.month.to_numpy(dtype=np.int8)
+    ym_i = year_i.astype(np.int32) * 12 + month_i - 1 # Months since year 0
+    dow_i = date_parts.dayofweek.to_numpy(dtype=np.int8) # Monday=0
+    # 'Profit/Loss' is stored as float32; every period total is summed in float64 so
+    # the bars agree with the Total P/L metric to the cent
+    pl_values = df_filtered['Profit/Loss'].to_numpy(dtype=np.float64)
+    pl_series = pd.Series(pl_values)
+
+    pl_by_year = pl_series.groupby(year_i).sum()
+    pl_by_year = pd.DataFrame({'Year': pl_by_year.index.astype(str), 'Profit/Loss': pl_by_year.to_numpy()})
+
+    pl_by_month = pl_series.groupby(ym_i).sum()
+    pl_by_month = pd.DataFrame({
+        'YearMonth': [f"{ym // 12}-{ym % 12 + 1:02d}" for ym in pl_by_month.index],
+        'Profit/Loss': pl_by_month.to_numpy()
+    })
+
+    day_order = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+    # Day name column for the history table (categorical codes, no per-row strings)
+    df_filtered['Day'] = pd.Categorical.from_codes(dow_i, categories=day_order, ordered=True)
+    # Seven weekday totals straight from the integer codes (already in Monday..Sunday order)
+    pl_by_day = pd.DataFrame({
+        'Day': day_order,
+        'Profit/Loss': np.bincount(dow_i, weights=pl_values, minlength=7)
+    })
+
+    # Total P/L and trade count per instrument, from one aggregation
+    instrument_agg = aggregate_by_instrument(df_filtered)
+
+    return {
+        'df_filtered': df_filtered,
+        'df_sorted': df_sorted_for_charts,
+        'stats': stats,
+        'pl_by_instrument': instrument_agg[['Instrument', 'Profit/Loss']],
+        'count_by_instrument': instrument_agg[['Instrument', 'Count']],
+        'pl_by_year': pl_by_year,
+        'pl_by_month': pl_by_month,
+        'pl_by_day': pl_by_day,
+        'tz_error': tz_error
+    }
+
+# --- Chart Building Function ---
+
+# Line charts with more points than this are downsampled before plotting. A chart a
+# ~1200px wide can't show more detail, and every point is sent to the browser as JSON.
+LINE_CHART_MAX_POINTS = 2000
+
+def lttb_indices(x, y, n_out):
+    """
+    Picks 'n_out' points that preserve the visual shape of a line chart, using the
+    Largest-Triangle-Three-Buckets (LTTB) algorithm. The first and last points are
+    always kept; every bucket in between keeps the point forming the largest triangle
+    with the previously kept point and the average of the next bucket.
+
+    Args:
+        x (np.ndarray): X values (float64), in ascending order.
+        y (np.ndarray): Y values (float64).
+        n_out (int): Number of points to keep (at least 3).
+
+    Returns:
+        np.ndarray: Sorted row positions of the points to keep.
+    """
+    n = len(x)
+    if n <= n_out:
+        return np.arange(n)
+
+    indices = np.empty(n_out, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+    bucket_size = (n - 2) / (n_out - 2) # The first and last points are buckets of their own
+    a = 0 # Position of the previously kept point
+    for i in range(n_out - 2):
+        # Current bucket and the following one (used only for its average point)
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        # Twice the triangle area for every candidate point in the current bucket
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(areas.argmax())
+        indices[i + 1] = a
+    return indices
+
+def downsample_line(df, y_col):
+    """
+    Returns 'df' reduced to at most LINE_CHART_MAX_POINTS rows (chosen with LTTB on
+    'Date' and 'y_col'), or 'df' itself if it's already small enough.
+    """
+    if len(df) <= LINE_CHART_MAX_POINTS:
+        return df
+    dates = df['Date'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    x = (dates - dates[0]).astype(np.float64) # Relative times keep full float64 precision
+    y = df[y_col].to_numpy(dtype=np.float64)
+    return df.iloc[lttb_indices(x, y, LINE_CHART_MAX_POINTS)]
+
+# Plotly figures are cached as resources: every session gets the *same* Figure
+# objects by reference (no pickling or copying on a cache hit). They must therefore be
+# treated as read-only; anything that changes a figure per session (e.g., the marker
+# toggles) works on its own copy. The cache is keyed only on 'filter_key', so reruns
+# that don't change the data or filters reuse the same figures.
+@st.cache_resource(max_entries=4)
+def build_figures(filter_key, _chart_data):
+    """
+    Builds every Plotly figure shown in the Visualizations section.
+
+    Args:
+        filter_key (tuple): Hashable description of the account, data version and
+            active filters. This is the only argument Streamlit hashes.
+        _chart_data (dict): The prepared DataFrames and stats to plot. The leading
+            underscore tells Streamlit not to hash it.
+
+    Returns:
+        dict: Figure name -> plotly Figure. 'balance' is None if no balance data exists.
+    """
+    print(f"RUNNING: build_figures() with key: {filter_key}")
+    df_sorted = _chart_data['df_sorted']
+    stats = _chart_data['stats']
+    figures = {}
+
+    # --- Account Balance Chart ---
+    # Filter out trades where balance data was not available (NA), with one NaN mask
+    # over the raw values. Usually every trade has a balance, so no rows are copied.
+    all_bal_values = df_sorted['Account Balance'].to_numpy(dtype=np.float64)
+    has_balance = ~np.isnan(all_bal_values)
+    if has_balance.all():
+        balance_data_df = df_sorted
+        bal_values = all_bal_values
+    else:
+        balance_data_df = df_sorted.iloc[has_balance]
+        bal_values = all_bal_values[has_balance]
+    if bal_values.size > 0:
+        # Calculate axis ranges with padding
+        # (NumPy reductions on the raw values; the rows are sorted, so the first/last Dates are the min/max)
+        min_bal = bal_values.min(); max_bal = bal_values.max(); padding_y = (max_bal - min_bal) * 0.1; yaxis_range_bal = [min_bal - padding_y, max_bal + padding_y]
+        min_date_bal = balance_data_df['Date'].iloc[0]; max_date_bal = balance_data_df['Date'].iloc[-1]; padding_x = timedelta(days=5); xaxis_range_bal = [min_date_bal - padding_x, max_date_bal + padding_x]
+        # Create line chart (markers are switched on/off later by the toggle)
+        # Axis ranges above use every trade; only the plotted points are downsampled
+        fig_balance = px.line(downsample_line(balance_data_df, 'Account Balance'), x='Date', y='Account Balance', title="Account Balance After Each Closed Trade", labels={'Account Balance': 'Account Balance (SGD)'},
+                              render_mode='webgl') # Scattergl: drawn with WebGL in the browser
+        fig_balance.update_traces(hovertemplate='Date: %{x}<br>Balance: $%{y:,.2f}')
+        fig_balance.update_layout(hovermode="x unified", yaxis_range=yaxis_range_bal, xaxis_range=xaxis_range_bal)
+        figures['balance'] = fig_balance
+    else:
+        figures['balance'] = None
+
+    # --- Cumulative P/L Chart ---
+    # Calculate axis ranges with padding
+    pl_data = df_sorted['Cumulative P/L'].to_numpy(); min_pl = pl_data.min(); max_pl = pl_data.max(); padding_y = max(abs(max_pl - min_pl) * 0.1, 1); yaxis_range_pl = [min_pl - padding_y, max_pl + padding_y]
+    min_date_pl = df_sorted['Date'].iloc[0]; max_date_pl = df_sorted['Date'].iloc[-1]; padding_x = timedelta(days=5); xaxis_range_pl = [min_date_pl - padding_x, max_date_pl + padding_x]
+    fig_line = px.line(downsample_line(df_sorted, 'Cumulative P/L'), x='Date', y='Cumulative P/L', labels={'Cumulative P/L': 'Cumulative P/L (SGD)'},
+                       render_mode='webgl') # Scattergl: drawn with WebGL in the browser
+    fig_line.update_traces(hovertemplate='Date: %{x}<br>Cumulative P/L: $%{y:,.2f}')
+    fig_line.update_layout(hovermode="x unified", yaxis_range=yaxis_range_pl, xaxis_range=xaxis_range_pl)
+    figures['cumulative_pl'] = fig_line
+
+    # --- Distribution Charts ---
+    # Pie chart for Win/Loss count
+    pie_data = pd.DataFrame({'Metric': ['Wins', 'Losses'], 'Count': [stats['win_count'], stats['loss_count']]})
+    fig_pie = px.pie(pie_data, values='Count', names='Metric', title="Win/Loss Distribution", color='Metric', color_discrete_map={'Wins': 'green', 'Losses': 'red'})
+    fig_pie.update_traces(textinfo='percent+label+value')
+    figures['pie'] = fig_pie
+    # Histogram for P/L value distribution
+    # Binned here with NumPy, so only the 30 bar heights are sent to the browser
+    # instead of every trade's P/L
+    hist_counts, hist_edges = np.histogram(_chart_data['df_filtered']['Profit/Loss'].to_numpy(dtype=np.float64), bins=30)
+    fig_hist = px.bar(x=(hist_edges[:-1] + hist_edges[1:]) / 2, y=hist_counts, title="Distribution of Trade P/L", text_auto=True,
+                      labels={'x': 'Profit/Loss', 'y': 'count'})
+    fig_hist.update_traces(width=hist_edges[1] - hist_edges[0], customdata=np.column_stack((hist_edges[:-1], hist_edges[1:])),
+                           marker_line_color='black', marker_line_width=1,
+                           hovertemplate='P/L Range: %{customdata[0]:,.2f} to %{customdata[1]:,.2f}<br>Count: %{y}')
+    fig_hist.update_layout(bargap=0)
+    figures['histogram'] = fig_hist
+
+    # --- Instrument Charts ---
+    # Bar chart for P/L by Instrument
+    fig_inst_pl = px.bar(_chart_data['pl_by_instrument'].sort_values('Profit/Loss', ascending=False),
+                         x='Instrument', y='Profit/Loss', color='Profit/Loss',
+                         color_continuous_scale=px.colors.diverging.RdYlGn, # Red-Yellow-Green scale
+                         title="Total P/L by Instrument")
+    fig_inst_pl.update_traces(hovertemplate='Instrument: %{x}<br>Total P/L: $%{y:,.2f}')
+    figures['instrument_pl'] = fig_inst_pl
+    # Bar chart for Trade Count by Instrument
+    fig_inst_count = px.bar(_chart_data['count_by_instrument'].sort_values('Count', ascending=False),
+                            x='Instrument', y='Count', title="Trade Count by Instrument")
+    fig_inst_count.update_traces(hovertemplate='Instrument: %{x}<br>Count: %{y}')
+    figures['instrument_count'] = fig_inst_count
+
+    # --- Time-based Charts ---
+    # Bar chart for P/L by Year
+    fig_yearly_pl = px.bar(_chart_data['pl_by_year'], x='Year', y='Profit/Loss', title="Total P/L by Year",
+                           color='Profit/Loss', color_continuous_scale=px.colors.diverging.RdYlGn)
+    fig_yearly_pl.update_traces(hovertemplate='Year: %{x}<br>Total P/L: $%{y:,.2f}')
+    figures['yearly_pl'] = fig_yearly_pl
+    # Bar chart for P/L by Month
+    fig_monthly_pl = px.bar(_chart_data['pl_by_month'], x='YearMonth', y='Profit/Loss', title="Total P/L by Month",
+                            color='Profit/Loss', color_continuous_scale=px.colors.diverging.RdYlGn,
+                            labels={'YearMonth': 'Month'})
+    fig_monthly_pl.update_traces(hovertemplate='Month: %{x}<br>Total P/L: $%{y:,.2f}')
+    figures['monthly_pl'] = fig_monthly_pl
+    # Bar chart for P/L by Day of Week
+    fig_day_pl = px.bar(_chart_data['pl_by_day'], x='Day', y='Profit/Loss', title="Total P/L by Day",
+                        color='Profit/Loss', color_continuous_scale=px.colors.diverging.RdYlGn,
+                        labels={'Day': 'Day'})
+    fig_day_pl.update_traces(hovertemplate='Day: %{x}<br>Total P/L: $%{y:,.2f}')
+    figures['day_pl'] = fig_day_pl
+
+    return figures
+
+# --- CSV Export Function ---
+# Cached on 'filter_key' only (the DataFrame isn't hashed), so once the CSV has been
+# prepared, later reruns with the same filters reuse the bytes instead of re-encoding.
+@st.cache_data(max_entries=2, show_spinner=False)
+def build_csv_bytes(filter_key, _df):
+    """
+    Encodes the given trade DataFrame as UTF-8 CSV bytes for the download button.
+    """
+    print(f"RUNNING: build_csv_bytes() with key: {filter_key}")
+    return _df.to_csv(index=False).encode('utf-8')
+
+# --- Chart Fragments ---
+# The marker toggles live inside fragments, so flipping one only reruns its own chart
+# section instead of the whole script.
+
+@st.fragment
+def balance_chart_fragment(fig_balance):
+    """
+    Renders the Account Balance chart with its 'Show Markers' toggle.
+    'fig_balance' is None if no balance data exists for the period.
+    """
+    st.subheader("Account Balance Trend (After Trade)")
+    st.session_state.show_balance_markers = st.toggle("Show Markers", value=st.session_state.show_balance_markers, key="balance_markers_toggle")
+    if fig_balance is not None:
+        # Only the trace mode changes with the toggle. The cached figure is shared by
+        # every session, so the mode is set on a copy made for this render.
+        st.plotly_chart(go.Figure(fig_balance).update_traces(mode='lines+markers' if st.session_state.show_balance_markers else 'lines'),
+                        width='stretch')
+    else:
+        st.info("Account balance data not available in transaction history for this period.")
+
+@st.fragment
+def cumulative_pl_chart_fragment(fig_line):
+    """
+    Renders the Cumulative P/L chart with its 'Show Markers' toggle.
+    """
+    st.subheader("Cumulative P/L Trend")
+    st.session_state.show_pl_markers = st.toggle("Show Markers", value=st.session_state.show_pl_markers, key="pl_markers_toggle")
+    # Set the mode on a per-render copy (the cached figure is shared by every session)
+    st.plotly_chart(go.Figure(fig_line).update_traces(mode='lines+markers' if st.session_state.show_pl_markers else 'lines'),
+                    width='stretch')
+
 # --- Helper function to calculate preset date ranges ---
+# Memoized: the inputs only change when the preset or the day changes, but the
+# preset display block calls this on every rerun.
+@functools.lru_cache(maxsize=8)
 def calculate_preset_dates(preset, min_hist_date, today):
     """
     Calculates the start and end date objects based on the selected preset string.
@@ -541,11 +1078,15 @@ def main():
     # Display the main title of the dashboard
     st.title("My Oanda Trading Dashboard 📈")
 
+    # Read the clock once per rerun; every default/reset below uses the same 'today'
+    now = datetime.now()
+    today = now.date()
+
     # --- Initialize Streamlit Session State ---
     # session_state is used to store variables that persist between reruns,
     # such as filter values, UI states (e.g., 'editing_demo'), and cached data keys.
     if "refresh_key" not in st.session_state: 
-        st.session_state.refresh_key = datetime.now()
+        st.session_state.refresh_key = now
     if "selected_instruments" not in st.session_state: 
         st.session_state.selected_instruments = []
     if "show_balance_markers" not in st.session_state: 
@@ -555,11 +1096,11 @@ def main():
     if "filter_start_date" not in st.session_state: 
         st.session_state.filter_start_date = None
     if "filter_end_date" not in st.session_state: 
-        st.session_state.filter_end_date = datetime.now().date()
+        st.session_state.filter_end_date = today
     if "custom_start_date" not in st.session_state: 
         st.session_state.custom_start_date = None
     if "custom_end_date" not in st.session_state: 
-        st.session_state.custom_end_date = datetime.now().date()
+        st.session_state.custom_end_date = today
     if "date_preset" not in st.session_state: 
         st.session_state.date_preset = "All Time"
     if "show_edit_page" not in st.session_state:
@@ -602,8 +1143,9 @@ def main():
             """
             new_env = st.session_state.account_toggle
             st.session_state.active_environment = "demo" if new_env == "Demo" else "live"
-            # Clear all caches and reset filters when switching accounts
-            st.cache_data.clear() 
+            # Re-fetch the summary for the new account and reset filters.
+            # (Trade history and filtered data are keyed on the account, so no other cache needs clearing.)
+            get_account_summary.clear()
             st.session_state.selected_instruments = []
             st.session_state.filter_start_date = None 
             st.session_state.filter_end_date = datetime.now().date()
@@ -632,18 +1174,20 @@ def main():
     st.sidebar.markdown("---")
         
     # Refresh Button
-    # This button clears all data caches and resets filters
+    # This button re-fetches the account summary and resets filters. The trade history
+    # is keyed on the summary's last transaction ID, so it's only re-fetched (as a delta)
+    # if new transactions exist.
     if st.sidebar.button("Refresh Data", width='stretch'):
-        st.cache_data.clear() # Clear all @st.cache_data functions
-        st.session_state.refresh_key = datetime.now() # Update the key to trigger re-fetch
+        get_account_summary.clear()
+        st.session_state.refresh_key = now # Update the key to trigger re-fetch
         # Reset all filters to their defaults
         st.session_state.selected_instruments = []
         st.session_state.show_balance_markers = False
         st.session_state.show_pl_markers = False
         st.session_state.filter_start_date = None
-        st.session_state.filter_end_date = datetime.now().date()
+        st.session_state.filter_end_date = today
         st.session_state.custom_start_date = None
-        st.session_state.custom_end_date = datetime.now().date()
+        st.session_state.custom_end_date = today
         st.session_state.date_preset = "All Time"
         st.rerun() 
         
@@ -664,7 +1208,7 @@ def main():
         # Extract key summary details
         last_id = summary_response['account']['lastTransactionID']
         env_label = st.session_state.active_environment.title()
-        st.header(f"Account Summary ({config['account_id']} - **{env_label}**)")
+        st.header(f"Account Summary ({config['ACCOUNT_ID']} - **{env_label}**)")
         account_balance = float(summary_response['account']['balance'])
         account_pl = float(summary_response['account']['pl']) # Unrealized P/L
         margin_avail = float(summary_response['account']['marginAvailable'])
@@ -694,7 +1238,8 @@ def main():
         # --- [END Economic Events Section] ---
 
         # Fetch trade history (cached)
-        trade_df = fetch_trade_history(refresh_key, last_id)
+        # Shared cached object (not a copy): never modify trade_df in place
+        trade_df = fetch_trade_history(config['ACCOUNT_ID'], last_id)
 
         # --- Main Content Area (Only if trade data is available) ---
         if trade_df is not None and not trade_df.empty:
@@ -705,8 +1250,7 @@ def main():
             with st.sidebar.expander("Trade & Date Filters", expanded=True):
 
                 # Get the date range of the entire trade history
-                min_hist_date = trade_df['Date'].min().date()
-                today = datetime.now().date()
+                min_hist_date = trade_df['Date'].iloc[0].date() # trade_df is sorted by Date
 
                 # Initialize filter dates on first run
                 if st.session_state.filter_start_date is None:
@@ -714,6 +1258,7 @@ def main():
                     st.session_state.custom_start_date = min_hist_date 
 
                 # --- Date Preset ---
+                date_preset = st.session_state.date_preset # Read once, used below
                 date_options = ["All Time", "Year-to-Date (YTD)", "This Month", "Last Month", "Last 7 Days", "Custom"]
                 
                 # Use a selectbox for date presets
@@ -721,18 +1266,18 @@ def main():
                     "Select Date Range",
                     options=date_options,
                     key="date_preset_radio", # Key links this to the session state
-                    index=date_options.index(st.session_state.date_preset), 
+                    index=date_options.index(date_preset), 
                     on_change=preset_changed_callback, # Callback to update dates
                     args=(min_hist_date, today) # Pass arguments to the callback
                 )
 
                 # --- Conditional Date Display ---
                 # Disable custom date pickers unless "Custom" is selected
-                custom_disabled = st.session_state.date_preset != "Custom"
+                custom_disabled = date_preset != "Custom"
 
-                if st.session_state.date_preset != "Custom":
+                if custom_disabled:
                     # If not 'Custom', show the calculated range as text
-                    start_display, end_display = calculate_preset_dates(st.session_state.date_preset, min_hist_date, today)
+                    start_display, end_display = calculate_preset_dates(date_preset, min_hist_date, today)
                     st.markdown(f"**Selected Range:**")
                     start_display_str = start_display.strftime('%d/%m/%Y')
                     end_display_str = end_display.strftime('%d/%m/%Y')
@@ -760,7 +1305,9 @@ def main():
 
                 # --- Instrument Filter ---
                 # Get all unique instruments from the *entire* history
-                all_instruments = sorted(trade_df['Instrument'].unique())
+                # ('Instrument' is categorical: its categories are already the unique
+                # values, so no scan of the column is needed)
+                all_instruments = sorted(trade_df['Instrument'].cat.categories)
                 st.multiselect(
                     "Select Instruments (optional)",
                     options=all_instruments,
@@ -773,67 +1320,32 @@ def main():
 
 
             # --- Apply Filters to Data ---
-            # Convert filter dates to UTC-aware datetimes for comparison
-            # (since the DataFrame 'Date' column is in UTC)
-            start_datetime_utc = pd.to_datetime(st.session_state.filter_start_date).tz_localize('UTC')
-            # Add one day to the end date to make the range inclusive
-            end_datetime_utc = pd.to_datetime(st.session_state.filter_end_date + timedelta(days=1)).tz_localize('UTC')
-            
-            # Apply date filter
-            df_filtered_utc = trade_df[(trade_df['Date'] >= start_datetime_utc) & (trade_df['Date'] < end_datetime_utc)]
-            
-            # Apply instrument filter if any are selected
-            if st.session_state.selected_instruments:
-                df_filtered_utc = df_filtered_utc[df_filtered_utc['Instrument'].isin(st.session_state.selected_instruments)].copy()
-            else:
-                df_filtered_utc = df_filtered_utc.copy()
+            # Filtering, the cumulative P/L, the statistics and the chart aggregates depend
+            # only on the data and the filter values, so they are cached together behind a
+            # single lookup: pure UI reruns skip all of them.
+            # Bind the filter values to locals once (they don't change for the rest of the run)
+            filter_start_date = st.session_state.filter_start_date
+            filter_end_date = st.session_state.filter_end_date
+            selected_instruments = st.session_state.selected_instruments
+            data_key = (config['ACCOUNT_ID'], last_id) # Identifies the trade history version
+            instruments_key = tuple(sorted(selected_instruments)) # Hashable, order-independent
+            prepared = prepare_filtered(data_key, trade_df, filter_start_date, filter_end_date, instruments_key)
 
 
             # --- Process and Display Filtered Results ---
-            if df_filtered_utc.empty:
+            if prepared is None:
                 st.warning("No trade data found matching your filters.")
             else:
-                # --- Convert Timezone for Display (for trade history) ---
-                # We keep the UTC dataframe for calculations but convert this
-                # one for display in the table.
-                try:
-                    df_filtered = df_filtered_utc.copy()
-                    # Convert to 'Asia/Singapore' for display
-                    df_filtered['Date'] = df_filtered['Date'].dt.tz_convert('Asia/Singapore')
-                except Exception as tz_error:
-                    st.error(f"Error converting timezone: {tz_error}")
-                    df_filtered = df_filtered_utc # Fallback to UTC
-
-                # --- Calculate Statistics & Prepare Chart Data ---
-                
-                # Create a chronologically sorted DF for cumulative charts
-                df_filtered_sorted_for_charts = df_filtered_utc.sort_values(by='Date', ascending=True).copy()
-                # Calculate Cumulative P/L on the sorted data
-                df_filtered_sorted_for_charts['Cumulative P/L'] = df_filtered_sorted_for_charts['Profit/Loss'].cumsum()
-                
-                # Calculate all key performance indicators
-                stats = calculate_statistics(df_filtered, df_filtered_sorted_for_charts)
-                
-                # Prepare data for Bar Charts (using the display-timezone DF)
-                df_filtered['Year'] = df_filtered['Date'].dt.year.astype(str)
-                pl_by_year = df_filtered.groupby('Year')['Profit/Loss'].sum().reset_index()
-                
-                df_filtered['YearMonth'] = df_filtered['Date'].dt.strftime('%Y-%m')
-                pl_by_month = df_filtered.groupby('YearMonth')['Profit/Loss'].sum().reset_index()
-                
-                df_filtered['Day'] = df_filtered['Date'].dt.day_name()
-                day_order = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
-                pl_by_day = df_filtered.groupby('Day')['Profit/Loss'].sum().reindex(day_order).reset_index()
-                
-                pl_by_instrument = df_filtered.groupby('Instrument')['Profit/Loss'].sum().reset_index()
-                count_by_instrument = df_filtered['Instrument'].value_counts().reset_index()
-                count_by_instrument.columns = ['Instrument', 'Count']
+                df_filtered = prepared['df_filtered']
+                stats = prepared['stats']
+                if prepared['tz_error']:
+                    st.error(f"Error converting timezone: {prepared['tz_error']}")
 
                 # --- Display Primary Statistics with Tooltips ---
                 # Check if any filters are active
-                is_filtered = (st.session_state.filter_start_date != min_hist_date) or \
-                                  (st.session_state.filter_end_date != today) or \
-                                  bool(st.session_state.selected_instruments)
+                is_filtered = (filter_start_date != min_hist_date) or \
+                                  (filter_end_date != today) or \
+                                  bool(selected_instruments)
                 stats_title = "Overall Statistics (Filtered)" if is_filtered else "Overall Statistics"
                 st.header(stats_title)
                 
@@ -850,38 +1362,18 @@ def main():
                 cols_row3[2].metric("Largest Loss (SGD)", f"${stats['largest_loss']:,.2f}", help="The single largest loss taken on a closed trade.")
 
                 # --- Charts Section ---
+                # Build (or reuse from cache) all figures for the current filter state
+                filter_key = data_key + (filter_start_date, filter_end_date, instruments_key)
+                figures = build_figures(filter_key, prepared) # Same keys as the chart data dict
+
                 st.header("Visualizations"); st.markdown("---")
                 
                 # --- Account Balance Chart ---
-                st.subheader("Account Balance Trend (After Trade)")
-                st.session_state.show_balance_markers = st.toggle("Show Markers", value=st.session_state.show_balance_markers, key="balance_markers_toggle")
-                # Filter out trades where balance data was not available (NA)
-                balance_data_df = df_filtered_sorted_for_charts.dropna(subset=['Account Balance'])
-                
-                if not balance_data_df.empty:
-                    # Calculate axis ranges with padding
-                    min_bal = balance_data_df['Account Balance'].min(); max_bal = balance_data_df['Account Balance'].max(); padding_y = (max_bal - min_bal) * 0.1; yaxis_range_bal = [min_bal - padding_y, max_bal + padding_y]
-                    min_date_bal = balance_data_df['Date'].min(); max_date_bal = balance_data_df['Date'].max(); padding_x = timedelta(days=5); xaxis_range_bal = [min_date_bal - padding_x, max_date_bal + padding_x]
-                    # Create line chart
-                    fig_balance = px.line(balance_data_df, x='Date', y='Account Balance', title="Account Balance After Each Closed Trade", labels={'Account Balance': 'Account Balance (SGD)'}, markers=st.session_state.show_balance_markers)
-                    fig_balance.update_traces(hovertemplate='Date: %{x}<br>Balance: $%{y:,.2f}')
-                    fig_balance.update_layout(hovermode="x unified", yaxis_range=yaxis_range_bal, xaxis_range=xaxis_range_bal)
-                    st.plotly_chart(fig_balance, width='stretch')
-                else:
-                    st.info("Account balance data not available in transaction history for this period.")
+                balance_chart_fragment(figures['balance'])
                 
                 # --- Cumulative P/L Chart ---
                 st.markdown("---") 
-                st.subheader("Cumulative P/L Trend")
-                st.session_state.show_pl_markers = st.toggle("Show Markers", value=st.session_state.show_pl_markers, key="pl_markers_toggle")
-                # Calculate axis ranges with padding
-                pl_data = df_filtered_sorted_for_charts['Cumulative P/L']; min_pl = pl_data.min(); max_pl = pl_data.max(); padding_y = max(abs(max_pl - min_pl) * 0.1, 1); yaxis_range_pl = [min_pl - padding_y, max_pl + padding_y]
-                min_date_pl = df_filtered_sorted_for_charts['Date'].min(); max_date_pl = df_filtered_sorted_for_charts['Date'].max(); padding_x = timedelta(days=5); xaxis_range_pl = [min_date_pl - padding_x, max_date_pl + padding_x]
-                # Create line chart
-                fig_line = px.line(df_filtered_sorted_for_charts, x='Date', y='Cumulative P/L', labels={'Cumulative P/L': 'Cumulative P/L (SGD)'}, markers=st.session_state.show_pl_markers)
-                fig_line.update_traces(hovertemplate='Date: %{x}<br>Cumulative P/L: $%{y:,.2f}')
-                fig_line.update_layout(hovermode="x unified", yaxis_range=yaxis_range_pl, xaxis_range=xaxis_range_pl)
-                st.plotly_chart(fig_line, width='stretch')
+                cumulative_pl_chart_fragment(figures['cumulative_pl'])
                 
                 # --- Distribution Charts ---
                 st.markdown("---")
@@ -889,15 +1381,10 @@ def main():
                 col1, col2 = st.columns(2)
                 with col1:
                     # Pie chart for Win/Loss count
-                    pie_data = pd.DataFrame({'Metric': ['Wins', 'Losses'], 'Count': [stats['win_count'], stats['loss_count']]})
-                    fig_pie = px.pie(pie_data, values='Count', names='Metric', title="Win/Loss Distribution", color='Metric', color_discrete_map={'Wins': 'green', 'Losses': 'red'})
-                    fig_pie.update_traces(textinfo='percent+label+value') 
-                    st.plotly_chart(fig_pie, width='stretch')
+                    st.plotly_chart(figures['pie'], width='stretch')
                 with col2:
                     # Histogram for P/L value distribution
-                    fig_hist = px.histogram(df_filtered, x="Profit/Loss", nbins=30, title="Distribution of Trade P/L", text_auto=True) 
-                    fig_hist.update_traces(marker_line_color='black', marker_line_width=1, hovertemplate='P/L Range: %{x}<br>Count: %{y}') 
-                    st.plotly_chart(fig_hist, width='stretch')
+                    st.plotly_chart(figures['histogram'], width='stretch')
                 
                 # --- Instrument Charts ---
                 st.markdown("---")
@@ -905,40 +1392,21 @@ def main():
                 col1, col2 = st.columns(2) 
                 with col1:
                         # Bar chart for P/L by Instrument
-                        fig_inst_pl = px.bar(pl_by_instrument.sort_values('Profit/Loss', ascending=False), 
-                                             x='Instrument', y='Profit/Loss', color='Profit/Loss', 
-                                             color_continuous_scale=px.colors.diverging.RdYlGn, # Red-Yellow-Green scale
-                                             title="Total P/L by Instrument")
-                        fig_inst_pl.update_traces(hovertemplate='Instrument: %{x}<br>Total P/L: $%{y:,.2f}')
-                        st.plotly_chart(fig_inst_pl, width='stretch')
+                        st.plotly_chart(figures['instrument_pl'], width='stretch')
                 with col2:
                         # Bar chart for Trade Count by Instrument
-                        fig_inst_count = px.bar(count_by_instrument.sort_values('Count', ascending=False), 
-                                                x='Instrument', y='Count', title="Trade Count by Instrument")
-                        fig_inst_count.update_traces(hovertemplate='Instrument: %{x}<br>Count: %{y}')
-                        st.plotly_chart(fig_inst_count, width='stretch')
+                        st.plotly_chart(figures['instrument_count'], width='stretch')
                 
                 # --- Time-based Charts ---
                 st.markdown("---")
                 st.subheader("Performance Over Time")
                 # Bar chart for P/L by Year
-                fig_yearly_pl = px.bar(pl_by_year, x='Year', y='Profit/Loss', title="Total P/L by Year", 
-                                       color='Profit/Loss', color_continuous_scale=px.colors.diverging.RdYlGn)
-                fig_yearly_pl.update_traces(hovertemplate='Year: %{x}<br>Total P/L: $%{y:,.2f}')
-                st.plotly_chart(fig_yearly_pl, width='stretch')
+                st.plotly_chart(figures['yearly_pl'], width='stretch')
                 # Bar chart for P/L by Month
-                fig_monthly_pl = px.bar(pl_by_month, x='YearMonth', y='Profit/Loss', title="Total P/L by Month", 
-                                        color='Profit/Loss', color_continuous_scale=px.colors.diverging.RdYlGn, 
-                                        labels={'YearMonth': 'Month'})
-                fig_monthly_pl.update_traces(hovertemplate='Month: %{x}<br>Total P/L: $%{y:,.2f}')
-                st.plotly_chart(fig_monthly_pl, width='stretch')
+                st.plotly_chart(figures['monthly_pl'], width='stretch')
                 # Bar chart for P/L by Day of Week
                 st.subheader("Performance by Day of Week", help="This chart shows the total Profit/Loss realized on each day of the week, based on the closing time of the trade in your local timezone (SGT).")
-                fig_day_pl = px.bar(pl_by_day, x='Day', y='Profit/Loss', title="Total P/L by Day", 
-                                    color='Profit/Loss', color_continuous_scale=px.colors.diverging.RdYlGn, 
-                                    labels={'Day': 'Day'})
-                fig_day_pl.update_traces(hovertemplate='Day: %{x}<br>Total P/L: $%{y:,.2f}')
-                st.plotly_chart(fig_day_pl, width='stretch')
+                st.plotly_chart(figures['day_pl'], width='stretch')
                 st.markdown("---")
 
                 # --- Filtered Trade History Table & Download ---
@@ -948,24 +1416,34 @@ def main():
                 # Ensure all columns exist in the dataframe (e.g. 'Account Balance' might be all NA)
                 available_columns = [col for col in columns_to_show if col in df_filtered.columns]
                 
-                # Prepare CSV for download
-                df_csv = df_filtered[available_columns].copy()
-                csv_string = df_csv.to_csv(index=False).encode('utf-8')
-                
-                # Prepare DataFrame for display (format date string)
-                df_display = df_filtered[available_columns].copy()
-                df_display['Date'] = df_display['Date'].dt.strftime('%d/%m/%Y %H:%M:%S %Z')
+                # Most recent trades first. The tz-aware 'Date' column is passed as-is and
+                # formatted client-side, so no per-row strftime copy is built.
+                df_history = df_filtered[available_columns].iloc[::-1]
                 
-                # Display table with number formatting
-                st.dataframe(df_display.style.format({"Profit/Loss": "{:.2f}", "Account Balance": "{:.2f}"}), width='stretch')
-                
-                # Download Button
-                st.download_button(
-                    label="📥 Download Filtered Data as CSV",
-                    data=csv_string,
-                    file_name=f"oanda_trades_{st.session_state.filter_start_date}_to_{st.session_state.filter_end_date}.csv",
-                    mime='text/csv',
+                # Display table with formatting (applied client-side, no pandas Styler)
+                st.dataframe(
+                    df_history,
+                    column_config={
+                        "Date": st.column_config.DatetimeColumn(format="DD/MM/YYYY HH:mm:ss Z"),
+                        "Amount": st.column_config.NumberColumn(format="%.0f"), # Whole units (stored as float32)
+                        "Profit/Loss": st.column_config.NumberColumn(format="$%.2f"),
+                        "Account Balance": st.column_config.NumberColumn(format="$%.2f")
+                    },
+                    width='stretch'
                 )
+                
+                # --- CSV Download ---
+                # The CSV is only built after the user asks for it ("prepare on click"),
+                # and stays ready until the filters change.
+                if st.button("Prepare CSV Download"):
+                    st.session_state.csv_ready_key = filter_key
+                if st.session_state.get('csv_ready_key') == filter_key:
+                    st.download_button(
+                        label="📥 Download Filtered Data as CSV",
+                        data=build_csv_bytes(filter_key, df_history),
+                        file_name=f"oanda_trades_{filter_start_date}_to_{filter_end_date}.csv",
+                        mime='text/csv',
+                    )
 
         # --- Handle Case: No Trade Data Found ---
         else: